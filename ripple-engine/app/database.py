@@ -1,8 +1,61 @@
+import asyncio
 import os
-from sqlmodel import create_engine
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database.db")
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
\ No newline at end of file
+# Map plain URLs onto the async drivers: aiosqlite for SQLite, asyncpg for Postgres.
+_ASYNC_DRIVERS = {
+    "sqlite://": "sqlite+aiosqlite://",
+    "postgres://": "postgresql+asyncpg://",
+    "postgresql://": "postgresql+asyncpg://",
+}
+
+def get_async_url(url: str) -> str:
+    for prefix, async_prefix in _ASYNC_DRIVERS.items():
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+connect_args = {"timeout": 30} if IS_SQLITE else {}
+
+# Explicit pool sizing so bursts queue briefly instead of exhausting the default 5 + 10.
+# SQLite connections are never recycled so their page cache stays warm; connections to a
+# database server are recycled hourly to stay ahead of server or proxy idle timeouts.
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+POOL_RECYCLE = -1 if IS_SQLITE else 3600
+
+engine = create_async_engine(
+    get_async_url(DATABASE_URL),
+    connect_args=connect_args,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+
+AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA cache_size=-65536")   # 64 MB
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456") # 256 MB
+        cur.close()
+
+async def warm_pool() -> None:
+    """Opens pool_size connections up front so early requests skip the connect handshake."""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 0
+    conns = await asyncio.gather(*(engine.connect() for _ in range(size)))
+    await asyncio.gather(*(conn.close() for conn in conns))
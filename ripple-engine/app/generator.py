@@ -1,43 +1,54 @@
 import google.generativeai as genai
+import asyncio
 import os
-import json
 import sys
+from types import MappingProxyType
 from typing import List
 
+import orjson
+
+from .llm_cache import MODEL_NAME, build_cache
+from .semantic_cache import build_semantic_cache
+
 # Configure the API on module load.
 try:
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         print("FATAL ERROR: GOOGLE_API_KEY environment variable not set.")
-    genai.configure(api_key=api_key, transport='rest')
+    # No explicit transport: sync clients use gRPC and async clients grpc_asyncio, each
+    # keeping one persistent HTTP/2 channel that multiplexes concurrent calls. The old
+    # transport='rest' also applied to the async client used by generate_content_async.
+    genai.configure(api_key=api_key, transport=os.getenv("GENAI_TRANSPORT") or None)
 except Exception as e:
     print(f"Error configuring GenerativeAI: {e}")
 
+# Built once and shared; the model object is safe to use from concurrent calls.
+_MODEL = genai.GenerativeModel(MODEL_NAME)
+# gemini-1.5-flash's output ceiling; larger requests are rejected or truncated mid-JSON.
+MAX_OUTPUT_TOKENS = 8192
 
-def get_prompt(text: str, platforms: List[str]) -> str:
-    """Creates a detailed, dynamic prompt for the LLM based on selected platforms."""
-    
-    # Define the specific instructions for each platform
-    platform_instructions = {
-        "Twitter": "One 'Twitter' post. It must be engaging, under 280 characters, and use emojis.",
-        "LinkedIn": "One 'LinkedIn' post. It should be professional, insightful, and aimed at a business audience.",
-        "Facebook": "One 'Facebook' post. It should be friendly and conversational, encouraging comments and shares.",
-        "Pinterest": "One 'Pinterest' Pin description. It should be keyword-rich, descriptive, and inspiring, suitable for an image or infographic related to the text.",
-        "Reddit": "One 'Reddit' post title and body. The title should be engaging or controversial to spark discussion. The body should provide a brief summary and a question for the community."
-    }
+# Exact-match cache of generated posts, shared by every call to create_ripples.
+cache = build_cache()
+# Near-duplicate cache; loads the sentence-transformer model once, here at import.
+semantic_cache = build_semantic_cache()
 
-    # Build the list of requested posts based on the user's selection
-    requested_posts = [platform_instructions[p] for p in platforms if p in platform_instructions]
-    
-    # If no valid platforms are selected, create a default generic post
-    if not requested_posts:
-        requested_posts.append("One 'General' post, summarizing the key takeaways in bullet points.")
 
-    post_list_str = "\n".join(f"- {i+1}. {req}" for i, req in enumerate(requested_posts))
+# Instructions for each supported platform. All of them are listed in the static
+# preamble so the prompt prefix never changes between requests.
+PLATFORM_INSTRUCTIONS = MappingProxyType({
+    "Twitter": "One 'Twitter' post. It must be engaging, under 280 characters, and use emojis.",
+    "LinkedIn": "One 'LinkedIn' post. It should be professional, insightful, and aimed at a business audience.",
+    "Facebook": "One 'Facebook' post. It should be friendly and conversational, encouraging comments and shares.",
+    "Pinterest": "One 'Pinterest' Pin description. It should be keyword-rich, descriptive, and inspiring, suitable for an image or infographic related to the text.",
+    "Reddit": "One 'Reddit' post title and body. The title should be engaging or controversial to spark discussion. The body should provide a brief summary and a question for the community.",
+    "General": "One 'General' post, summarizing the key takeaways in bullet points.",
+})
+_VALID_PLATFORMS = frozenset(PLATFORM_INSTRUCTIONS)
+_DEFAULT_PLATFORMS = ("General",)
+_PREFIXED_RULES = "\n".join(f"- {name}: {rule}" for name, rule in PLATFORM_INSTRUCTIONS.items())
 
-    return f"""
-Analyze the following article and generate a set of social media posts based on its content.
-The output must be a valid JSON object.
+STATIC_PREAMBLE = f"""
+You turn articles into social media posts. The output must be a valid JSON object.
 
 The JSON object must have a key called "social_posts" which is an array of post objects.
 Each post object in the array must have these keys:
@@ -45,29 +56,284 @@ Each post object in the array must have these keys:
 - "content": The text of the post, written in a style appropriate for the platform.
 - "hashtags": An array of relevant hashtags as strings, without the '#' symbol.
 
-Generate the following posts:
-{post_list_str}
+These are the rules for each platform:
+{_PREFIXED_RULES}
 
-Article to analyze:
----
-{text}
----
+Generate exactly one post for each platform listed in the request, and no others.
+The request names the platforms first and then gives the article to analyze.
 """
+# The preamble is far below the explicit CachedContent minimum (32k tokens), so it isn't
+# registered as one. Keeping it byte-identical at the head of every prompt lets the
+# provider's implicit prefix caching apply instead.
+
+
+def select_platforms(platforms: List[str]) -> List[str]:
+    """Keeps the supported platforms, falling back to a single General post."""
+    return [p for p in platforms if p in _VALID_PLATFORMS] or list(_DEFAULT_PLATFORMS)
+
+
+def get_dynamic_prompt(text: str, platforms: List[str]) -> str:
+    """Creates the per-request tail: the selected platforms and the article."""
+    return "".join((
+        "\n\nGenerate posts for platforms: ", ", ".join(select_platforms(platforms)),
+        "\n\nArticle:\n---\n", text, "\n---",
+    ))
+
+
+def get_prompt(text: str, platforms: List[str]) -> str:
+    """Creates the full prompt: the static preamble followed by the dynamic tail."""
+    return STATIC_PREAMBLE + get_dynamic_prompt(text, platforms)
+
+
+def get_batch_prompt(items: List[tuple]) -> str:
+    """Creates the dynamic tail for several articles answered in one call."""
+    parts = [
+        '\n\nThis request contains several articles. Return a JSON object with a key called "results", '
+        'an array with one object per article. Each object must have an "id" key holding the article '
+        'number and a "social_posts" key following the schema above.'
+    ]
+    for i, (text, platforms) in enumerate(items, start=1):
+        parts.append(f"ARTICLE_{i}:{get_dynamic_prompt(text, platforms)}")
+    return "\n\n".join(parts)
+
+
+# ===================================================================
+# RESPONSE SCHEMAS
+#   Gemini constrains its output to these, so the response text is
+#   always plain JSON that can be parsed directly.
+# ===================================================================
+_Schema = genai.protos.Schema
+_Type = genai.protos.Type
+
+_POST_SCHEMA = _Schema(
+    type=_Type.OBJECT,
+    properties={
+        "platform": _Schema(type=_Type.STRING),
+        "content": _Schema(type=_Type.STRING),
+        "hashtags": _Schema(type=_Type.ARRAY, items=_Schema(type=_Type.STRING)),
+    },
+    required=["platform", "content", "hashtags"],
+)
+
+POSTS_SCHEMA = _Schema(
+    type=_Type.OBJECT,
+    properties={"social_posts": _Schema(type=_Type.ARRAY, items=_POST_SCHEMA)},
+    required=["social_posts"],
+)
+
+BATCH_SCHEMA = _Schema(
+    type=_Type.OBJECT,
+    properties={
+        "results": _Schema(
+            type=_Type.ARRAY,
+            items=_Schema(
+                type=_Type.OBJECT,
+                properties={
+                    "id": _Schema(type=_Type.INTEGER),
+                    "social_posts": _Schema(type=_Type.ARRAY, items=_POST_SCHEMA),
+                },
+                required=["id", "social_posts"],
+            ),
+        )
+    },
+    required=["results"],
+)
+
+
+# Sampling is deliberately greedy (temperature 0) so identical requests get identical
+# posts, which is what makes the exact-match and semantic caches safe to serve.
+# Offering variety should go through a separate "regenerate" path that bypasses
+# the caches (e.g. by salting the key) rather than raising the temperature here.
+def _generation_config(schema, max_output_tokens: int) -> dict:
+    return {
+        "temperature": 0,
+        "top_p": 1,
+        "max_output_tokens": min(max_output_tokens, MAX_OUTPUT_TOKENS),
+        "response_mime_type": "application/json",
+        "response_schema": schema,
+    }
+
+
+def _output_token_budget(platforms: List[str]) -> int:
+    """Caps output at 256 tokens per platform plus 256 for JSON structure."""
+    return 256 * len(select_platforms(platforms)) + 256
+
+
+# ===================================================================
+# MICRO-BATCHING
+#   Concurrent calls to create_ripples from the same user are coalesced
+#   into a single multi-article Gemini request. Articles from different
+#   users never share a prompt, so one user's text can't steer or leak
+#   into another user's posts.
+# ===================================================================
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+BATCH_WAIT_MS = int(os.getenv("BATCH_WAIT_MS", 50))
+
+
+class _Bucket:
+    """One owner's pending requests, flushed together as a single call."""
+
+    def __init__(self, timer: asyncio.TimerHandle):
+        self.items: List[tuple] = []
+        self.budget = 0
+        self.timer = timer
+
 
-def create_ripples(article_text: str, platforms: List[str]) -> list | None:
+class BatchedGenerator:
+    """
+    Keeps a pending bucket per owner. A bucket is sent as one prompt `wait_ms` after its
+    first request, or sooner once it holds `max_size` items or the next item would push
+    its output budget past MAX_OUTPUT_TOKENS. Each caller's future resolves with
+    (posts, batched), where `batched` says whether the posts came out of a multi-article call.
+    """
+
+    def __init__(self, max_size: int = BATCH_MAX_SIZE, wait_ms: int = BATCH_WAIT_MS):
+        self.max_size = max_size
+        self.wait = wait_ms / 1000
+        self._buckets: dict = {}
+        self._in_flight: set = set()
+
+    async def submit(self, article_text: str, platforms: List[str], owner_id) -> tuple:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        item_budget = _output_token_budget(platforms)
+        bucket = self._buckets.get(owner_id)
+        if bucket is not None and bucket.budget + item_budget > MAX_OUTPUT_TOKENS:
+            self._flush(owner_id)
+            bucket = None
+        if bucket is None:
+            bucket = self._buckets[owner_id] = _Bucket(loop.call_later(self.wait, self._flush, owner_id))
+        bucket.items.append((article_text, platforms, fut))
+        bucket.budget += item_budget
+        if len(bucket.items) >= self.max_size:
+            self._flush(owner_id)
+        return await fut
+
+    def _flush(self, owner_id) -> None:
+        bucket = self._buckets.pop(owner_id, None)
+        if bucket is None:
+            return
+        bucket.timer.cancel()
+        # Process in the background so other buckets keep filling meanwhile.
+        task = asyncio.create_task(self._process(bucket.items))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def stop(self) -> None:
+        for bucket in self._buckets.values():
+            bucket.timer.cancel()
+        self._buckets.clear()
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    async def _process(self, batch: List[tuple]) -> None:
+        results: dict = {}
+        try:
+            if len(batch) == 1:
+                text, platforms, _ = batch[0]
+                response = await _MODEL.generate_content_async(get_prompt(text, platforms), generation_config=_generation_config(POSTS_SCHEMA, _output_token_budget(platforms)))
+                results[1] = orjson.loads(response.text).get('social_posts')
+            else:
+                prompt = STATIC_PREAMBLE + get_batch_prompt([(t, p) for t, p, _ in batch])
+                budget = sum(_output_token_budget(p) for _, p, _ in batch)
+                response = await _MODEL.generate_content_async(prompt, generation_config=_generation_config(BATCH_SCHEMA, budget))
+                for item in orjson.loads(response.text).get('results', []):
+                    results[int(item.get('id', 0))] = item.get('social_posts')
+        except Exception as e:
+            print(f"An error occurred in create_ripples: {e}")
+        batched = len(batch) > 1
+        for i, (_, _, fut) in enumerate(batch, start=1):
+            if not fut.done():
+                fut.set_result((results.get(i), batched))
+
+
+batcher = BatchedGenerator()
+
+
+async def _lookup_caches(key: str, article_text: str, platforms: List[str]):
+    """Checks the exact-match then the semantic cache. Returns (posts, embedding)."""
+    cached_posts = await cache.get(key)
+    if cached_posts is not None:
+        return cached_posts, None
+
+    # Embedding is CPU-bound, so keep it off the event loop.
+    embedding = await asyncio.to_thread(semantic_cache.embed, article_text)
+    similar_posts = semantic_cache.get(embedding, platforms)
+    if similar_posts is not None:
+        await cache.set(key, similar_posts)
+    return similar_posts, embedding
+
+
+async def _store_in_caches(key: str, embedding, platforms: List[str], posts: list) -> None:
+    await cache.set(key, posts)
+    semantic_cache.set(embedding, platforms, posts)
+
+
+# Generations currently in progress, by (owner, cache key). Identical requests arriving
+# before the first one has finished wait for its result instead of calling Gemini again.
+# Scoped per owner because a batched result may reflect that owner's other articles.
+_in_flight: dict = {}
+
+
+async def _generate_and_cache(key: str, embedding, article_text: str, platforms: List[str], owner_id) -> list | None:
+    posts, batched = await batcher.submit(article_text, platforms, owner_id)
+    # Only single-article answers are cached: the shared caches are keyed on this
+    # article alone, and a batched answer also depends on its batch-mates.
+    if posts and not batched:
+        await _store_in_caches(key, embedding, platforms, posts)
+    return posts
+
+
+async def create_ripples(article_text: str, platforms: List[str], owner_id) -> list | None:
     """
     The main function to generate social media posts.
     Takes article text and a list of platforms, then returns a list of post dictionaries.
     """
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = get_prompt(article_text, platforms) # Pass platforms to the prompt function
-        response = model.generate_content(prompt)
-        
-        cleaned_json = response.text.strip().lstrip("```json").rstrip("```")
-        data = json.loads(cleaned_json)
-        return data.get('social_posts')
+    key = cache.cache_key(article_text, platforms)
+    posts, embedding = await _lookup_caches(key, article_text, platforms)
+    if posts is not None:
+        return posts
 
+    flight_key = (owner_id, key)
+    task = _in_flight.get(flight_key)
+    if task is None:
+        # The generation runs as its own task, so cancelling whichever request started
+        # it doesn't cancel it for the others waiting on the same key.
+        task = asyncio.create_task(_generate_and_cache(key, embedding, article_text, platforms, owner_id))
+        _in_flight[flight_key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(flight_key, None))
+    # Shield so a disconnecting caller, leader or follower, can't cancel the shared result.
+    return await asyncio.shield(task)
+
+
+async def stream_ripples(article_text: str, platforms: List[str]):
+    """
+    Streaming variant of create_ripples. Yields ("delta", text) for each chunk
+    Gemini produces, then a final ("posts", list | None) once the full JSON is parsed.
+    Cache hits skip straight to the final event. Streams bypass the micro-batcher.
+    """
+    key = cache.cache_key(article_text, platforms)
+    posts, embedding = await _lookup_caches(key, article_text, platforms)
+    if posts is not None:
+        yield "posts", posts
+        return
+
+    chunks = []
+    try:
+        response = await _MODEL.generate_content_async(
+            get_prompt(article_text, platforms),
+            generation_config=_generation_config(POSTS_SCHEMA, _output_token_budget(platforms)),
+            stream=True,
+        )
+        async for chunk in response:
+            chunks.append(chunk.text)
+            yield "delta", chunk.text
+        posts = orjson.loads("".join(chunks)).get('social_posts')
     except Exception as e:
-        print(f"An error occurred in create_ripples: {e}")
-        return None
\ No newline at end of file
+        print(f"An error occurred in stream_ripples: {e}")
+        posts = None
+
+    if posts:
+        await _store_in_caches(key, embedding, platforms, posts)
+    yield "posts", posts
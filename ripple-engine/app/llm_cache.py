@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+import orjson
+from cachetools import TTLCache
+
+MODEL_NAME = "gemini-1.5-flash"
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_SIZE = 1024
+
+
+# ===================================================================
+# 1. BACKENDS
+#    Both backends store the decoded `social_posts` list for a key.
+# ===================================================================
+class MemoryBackend:
+    """In-process TTL cache. Only shared within a single worker."""
+
+    def __init__(self, maxsize: int = CACHE_MAX_SIZE, ttl: int = CACHE_TTL_SECONDS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[list]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, posts: list) -> None:
+        self._cache[key] = posts
+
+
+class RedisBackend:
+    """Redis-backed cache, shared across every worker pointing at the same server."""
+
+    def __init__(self, url: str, ttl: int = CACHE_TTL_SECONDS):
+        import redis.asyncio
+        self._redis = redis.asyncio.Redis.from_url(url)
+        self._ttl = ttl
+
+    async def get(self, key: str) -> Optional[list]:
+        raw = await self._redis.get(key)
+        return orjson.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, posts: list) -> None:
+        await self._redis.set(key, orjson.dumps(posts), ex=self._ttl)
+
+
+# ===================================================================
+# 2. CACHE FACADE
+# ===================================================================
+class LLMCache:
+    """Exact-match cache for generated posts, keyed on the full request."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(text: str, platforms: List[str]) -> str:
+        """Builds a deterministic key from the article, platforms and model."""
+        payload = json.dumps(
+            {"text": text, "platforms": sorted(platforms), "model": MODEL_NAME},
+            sort_keys=True,
+        )
+        return "ripple:posts:" + hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[list]:
+        try:
+            posts = await self.backend.get(key)
+        except Exception as e:
+            print(f"LLM cache read failed: {e}")
+            posts = None
+        if posts is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return posts
+
+    async def set(self, key: str, posts: list) -> None:
+        try:
+            await self.backend.set(key, posts)
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def build_cache() -> LLMCache:
+    """Uses Redis when REDIS_URL is set, otherwise an in-process TTL cache."""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return LLMCache(RedisBackend(redis_url))
+    return LLMCache(MemoryBackend())
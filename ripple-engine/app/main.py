@@ -1,31 +1,47 @@
 # --- Standard Library Imports ---
+import hashlib
 import os
-import json
+import asyncio
 import sys # New import to exit gracefully
+import time
 from contextlib import asynccontextmanager
 from datetime import timedelta
+from pathlib import Path
 from typing import List
 
 # --- Third-Party Imports ---
-from fastapi import FastAPI, Depends, HTTPException, status, Request
-from fastapi.responses import HTMLResponse
+from cachetools import TTLCache
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from sqlmodel import Session, SQLModel
+import jwt
+import orjson
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from sqlalchemy import func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.exceptions import HTTPException as StarletteHTTPException
 import stripe
 
 # --- Local Application Imports ---
 from . import generator
 from . import models
 from . import security
-from .database import engine
+from .database import AsyncSessionLocal, engine, warm_pool
+from .writer import writer
 
 # ===================================================================
 # 1. CONFIGURATION & VALIDATION
 # ===================================================================
 
 # --- NEW: Explicitly check for environment variables ---
-required_secrets = ["STRIPE_SECRET_KEY", "STRIPE_PRICE_ID", "YOUR_DOMAIN", "SECRET_KEY", "GOOGLE_API_KEY"]
+required_secrets = ["STRIPE_SECRET_KEY", "STRIPE_PRICE_ID", "STRIPE_WEBHOOK_SECRET", "YOUR_DOMAIN", "SECRET_KEY", "GOOGLE_API_KEY"]
 missing_secrets = [secret for secret in required_secrets if not os.getenv(secret)]
 
 if missing_secrets:
@@ -38,86 +54,249 @@ if missing_secrets:
 
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PRICE_ID = os.getenv("STRIPE_PRICE_ID")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 YOUR_DOMAIN = os.getenv("YOUR_DOMAIN")
+# Outside development the schema is owned by Alembic (`alembic upgrade head`), run once per
+# deploy before the workers start, so workers never issue DDL or race each other on it.
+APP_ENV = os.getenv("APP_ENV", "development")
+# Reverse proxies in front of the app that append the peer address to X-Forwarded-For
+# (1 behind Heroku's router). 0 means clients connect directly.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", 0))
+
+_STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+_INDEX_PATH = _STATIC_DIR / "index.html"
 
 # ===================================================================
 # 2. APP LIFESPAN
 # ===================================================================
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+EXPECTED_TABLES = {"user", "generation"}
+
+def verify_table_metadata():
+    # Guard against a stray or duplicate model module registering extra tables.
+    registered_tables = set(SQLModel.metadata.tables)
+    if registered_tables != EXPECTED_TABLES:
+        raise RuntimeError(f"Unexpected table metadata: {sorted(registered_tables)}")
+
+def _create_missing_indexes(sync_conn):
+    # create_all skips existing tables along with their indexes, so older databases get any
+    # index declared on the models since. IF NOT EXISTS, because SQLite's reflection (and so
+    # checkfirst) can't see expression indexes like ix_user_email_lower.
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            sync_conn.execute(CreateIndex(index, if_not_exists=True))
+
+async def create_db_and_tables():
+    # Development convenience only; migrations/versions holds the same schema for other environments.
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        if engine.dialect.name == "postgresql":
+            # Convert tables created while the column was still plain json; GIN needs jsonb.
+            await conn.exec_driver_sql(
+                "DO $$ BEGIN "
+                "IF (SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'generation' AND column_name = 'selected_platforms') = 'json' THEN "
+                "ALTER TABLE generation ALTER COLUMN selected_platforms TYPE jsonb USING selected_platforms::jsonb; "
+                "END IF; END $$"
+            )
+            # created_at used to be stamped in Python; give existing tables the server default.
+            await conn.exec_driver_sql('ALTER TABLE "user" ALTER COLUMN created_at SET DEFAULT now()')
+            await conn.exec_driver_sql('ALTER TABLE generation ALTER COLUMN created_at SET DEFAULT now()')
+        await conn.run_sync(_create_missing_indexes)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("INFO:     Starting up and creating database tables...")
-    create_db_and_tables()
+    loop = asyncio.get_running_loop()
+    print(f"INFO:     Event loop: {type(loop).__module__}.{type(loop).__name__}")
+    verify_table_metadata()
+    if APP_ENV == "development":
+        print("INFO:     Starting up and creating database tables...")
+        await create_db_and_tables()
+    else:
+        print(f"INFO:     Starting up ({APP_ENV}); schema is managed by Alembic...")
+    await warm_pool()
+    # The landing page never changes while the process runs, so read it once.
+    app.state.index_html = _INDEX_PATH.read_bytes()
+    # Precompute the validator and headers; the response objects themselves are built per
+    # request because middleware (e.g. GZip) rewrites their headers in place.
+    app.state.index_etag = '"' + hashlib.blake2b(app.state.index_html, digest_size=16).hexdigest() + '"'
+    app.state.index_headers = {"ETag": app.state.index_etag, "Cache-Control": "public, max-age=300"}
+    await security.warm_up()
+    generator.semantic_cache.load()
     yield
     print("INFO:     Shutting down...")
+    # Per-worker hit rates for operators; there is no admin role to expose them over HTTP.
+    print(f"INFO:     LLM cache stats: {generator.cache.stats()}")
+    await generator.batcher.stop()
+    await writer.stop()
+    generator.semantic_cache.save()
+    await engine.dispose()
 
 app = FastAPI(
     title="Ripple API",
     description="An API to generate social media posts from a given text.",
     version="0.5.1", # Version updated for better validation
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+def client_ip(request: Request) -> str:
+    """
+    The client address as seen by the outermost trusted proxy. Behind a proxy the socket
+    peer is the proxy itself, and entries left of the proxies' own hops are client-supplied.
+    """
+    if TRUSTED_PROXY_HOPS:
+        hops = [h.strip() for h in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if h.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return get_remote_address(request)
+
+# Per-client-IP rate limits for endpoints that burn CPU or LLM quota. With REDIS_URL set the
+# counters live in Redis, so the limit holds across every worker instead of per process.
+limiter = Limiter(key_func=client_ip, storage_uri=os.getenv("REDIS_URL") or "memory://")
+# /generate and /generate/stream draw from one per-IP budget.
+generate_limit = limiter.shared_limit("30/minute", scope="generate")
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+# FastAPI's built-in HTTPException handler ignores default_response_class and serializes
+# every 401/403/409 through json.dumps; route error bodies through orjson as well.
+@app.exception_handler(StarletteHTTPException)
+async def orjson_http_exception_handler(request: Request, exc: StarletteHTTPException):
+    if exc.status_code in (204, 304):
+        return await http_exception_handler(request, exc)
+    return ORJSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+# Compress text-heavy JSON/HTML bodies. Starlette adds Vary: Accept-Encoding and skips
+# text/event-stream, so /generate/stream keeps flushing chunk by chunk. ETags are computed
+# over the uncompressed body and stay the same across encodings.
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
+
 # ... (The rest of the file remains exactly the same) ...
 
 # ===================================================================
 # 3. DEPENDENCIES AND HELPERS (Unchanged)
 # ===================================================================
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    async with AsyncSessionLocal() as session:
         yield session
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+# Resolved users per token. The TTL is well under ACCESS_TOKEN_EXPIRE_MINUTES so
+# changes such as subscription_status are picked up quickly even without eviction.
+# token -> (user, exp). The token's own expiry is kept so a cached entry can't outlive it.
+_user_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def _evict_cached_user(user_id: int):
+    for token in [t for t, (u, _) in _user_cache.items() if u.id == user_id]:
+        _user_cache.pop(token, None)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = _user_cache.get(token)
+    if cached is not None:
+        user, exp = cached
+        if time.time() < exp:
+            return user
+        _user_cache.pop(token, None)
+        raise credentials_exception
     try:
         payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
         email: str = payload.get("sub")
         if email is None: raise credentials_exception
-    except JWTError:
+        exp = float(payload.get("exp", float("inf")))
+    except (jwt.InvalidTokenError, TypeError, ValueError):
         raise credentials_exception
-    user = session.query(models.User).filter(models.User.email == email).first()
+    # Use a short-lived session so no connection is held for the rest of the request.
+    async with AsyncSessionLocal() as session:
+        user = (await session.exec(select(models.User).where(models.User.email == email))).first()
     if user is None: raise credentials_exception
+    _user_cache[token] = (user, exp)
     return user
 
 # ===================================================================
 # 4. API ENDPOINTS (Unchanged)
 # ===================================================================
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
-    html_file_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'index.html')
-    with open(html_file_path) as f:
-        return HTMLResponse(content=f.read(), status_code=200)
+async def read_root(request: Request):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and app.state.index_etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": app.state.index_etag})
+    return HTMLResponse(content=app.state.index_html, headers=app.state.index_headers)
+
+# Fingerprints of recently failed (stored hash, password) pairs. Retrying the exact same
+# password against the same account is rejected after a fixed delay without hashing again.
+# Keying on the stored hash means a fingerprint stops matching, in every worker, as soon
+# as the account's password changes.
+_failed_logins = TTLCache(maxsize=100_000, ttl=15 * 60)
+FAILED_LOGIN_DELAY_SECONDS = 0.1
+
+def _login_fingerprint(hashed_password: str, password: str) -> str:
+    return hashlib.sha256(f"{hashed_password}\0{password}".encode()).hexdigest()
+
+# Unique indexes whose violation means the email is already registered. asyncpg reports the
+# constraint name; SQLite names the column for plain indexes and the index for expression ones.
+_EMAIL_UNIQUE_INDEXES = ("ix_user_email", "ix_user_email_lower")
+_SQLITE_EMAIL_UNIQUE_ERRORS = ("UNIQUE constraint failed: user.email", "UNIQUE constraint failed: index 'ix_user_email_lower'")
+
+def _is_duplicate_email(exc: IntegrityError) -> bool:
+    constraint = getattr(exc.orig.__cause__, "constraint_name", None)
+    if constraint is not None:
+        return constraint in _EMAIL_UNIQUE_INDEXES
+    return str(exc.orig).startswith(_SQLITE_EMAIL_UNIQUE_ERRORS)
 
 @app.post("/register", response_model=models.UserPublic)
-def register_user(user_create: models.UserCreate, session: Session = Depends(get_session)):
-    existing_user = session.query(models.User).filter(models.User.email == user_create.email).first()
-    if existing_user:
-        raise HTTPException(status_code=409, detail="An account with this email already exists.")
-    hashed_password = security.hash_password(user_create.password)
-    db_user = models.User(email=user_create.email, hashed_password=hashed_password)
-    session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+@limiter.limit("5/minute")
+async def register_user(request: Request, user_create: models.UserCreate, session: AsyncSession = Depends(get_session)):
+    hashed_password = await security.hash_password_async(user_create.password)
+    # INSERT ... RETURNING hands back the full row, so no refresh SELECT is needed, and the
+    # unique index on email rejects duplicates without a prior existence check.
+    stmt = (
+        insert(models.User)
+        .values(email=user_create.email, hashed_password=hashed_password)
+        .returning(models.User)
+    )
+    try:
+        db_user = (await session.execute(stmt)).scalar_one()
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if not _is_duplicate_email(e):
+            raise
+        raise HTTPException(status_code=409, detail="An account with this email already exists.") from e
     return db_user
 
 @app.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+@limiter.limit("5/minute")
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_session)):
+    login_failed = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Incorrect email or password",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    email = models.normalize_email(form_data.username)
+    user = (await session.exec(select(models.User).where(func.lower(models.User.email) == email))).first()
+    if not user:
+        # No hash runs on this path, so there is nothing to fast-reject.
+        raise login_failed
+    fingerprint = _login_fingerprint(user.hashed_password, form_data.password)
+    if fingerprint in _failed_logins:
+        await asyncio.sleep(FAILED_LOGIN_DELAY_SECONDS)
+        raise login_failed
+    verified, new_hash = await security.verify_and_update_password_async(form_data.password, user.hashed_password)
+    if not verified:
+        _failed_logins[fingerprint] = True
+        raise login_failed
+    if new_hash:
+        # Transparently migrate legacy bcrypt hashes to the current Argon2id parameters.
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = security.create_access_token(
         data={"sub": user.email}, expires_delta=access_token_expires
@@ -128,43 +307,96 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), ses
 def read_users_me(current_user: models.User = Depends(get_current_user)):
     return current_user
 
-@app.post("/generate", response_model=dict)
-def generate_posts_endpoint(article: models.Article, current_user: models.User = Depends(get_current_user), session: Session = Depends(get_session)):
-    if current_user.subscription_status == "free":
+def check_platform_access(user: models.User, platforms: List[str]):
+    if user.subscription_status == "free":
         pro_platforms = {"Twitter", "LinkedIn", "Pinterest", "Reddit"}
-        requested_platforms = set(article.platforms)
+        requested_platforms = set(platforms)
         if not requested_platforms.isdisjoint(pro_platforms):
             raise HTTPException(
                 status_code=403,
                 detail="Upgrade to Pro to generate posts for Twitter, LinkedIn, Pinterest, or Reddit."
             )
-    posts = generator.create_ripples(article.text, article.platforms)
+
+async def save_generation(article: models.Article, posts: list, owner_id: int):
+    # Written through the batch writer once the LLM call is done, so no session is held
+    # during the wait and concurrent results share one INSERT.
+    await writer.submit({
+        "original_text": article.text,
+        "generated_posts": orjson.dumps({"posts": posts}).decode(),
+        "selected_platforms": article.platforms,
+        "owner_id": owner_id,
+    })
+
+@app.post("/generate", response_model=dict)
+@generate_limit
+async def generate_posts_endpoint(request: Request, article: models.Article, current_user: models.User = Depends(get_current_user)):
+    check_platform_access(current_user, article.platforms)
+    posts = await generator.create_ripples(article.text, article.platforms, current_user.id)
     if not posts:
         raise HTTPException(status_code=500, detail="Failed to generate posts from the text.")
-    new_generation = models.Generation(
-        original_text=article.text,
-        generated_posts={"posts": posts},
-        selected_platforms=article.platforms,
-        owner_id=current_user.id
-    )
-    session.add(new_generation)
-    session.commit()
-    return {"status": "success", "posts": posts}
+    await save_generation(article, posts, current_user.id)
+    # Returning the response directly skips the response_model validation and
+    # jsonable_encoder walk over the posts; orjson encodes the dicts as they are.
+    return ORJSONResponse({"status": "success", "posts": posts})
+
+@app.post("/generate/stream")
+@generate_limit
+async def generate_posts_stream_endpoint(request: Request, article: models.Article, current_user: models.User = Depends(get_current_user)):
+    """Streams the raw model output as Server-Sent Events, then a final `done` event with the parsed posts."""
+    check_platform_access(current_user, article.platforms)
+
+    async def event_stream():
+        posts = None
+        async for kind, value in generator.stream_ripples(article.text, article.platforms):
+            if kind == "delta":
+                yield f"data: {orjson.dumps({'delta': value}).decode()}\n\n"
+            else:
+                posts = value
+        if not posts:
+            yield f"event: error\ndata: {orjson.dumps({'detail': 'Failed to generate posts from the text.'}).decode()}\n\n"
+            return
+        # Persist once the stream is complete so DB I/O doesn't interleave with streaming.
+        await save_generation(article, posts, current_user.id)
+        yield f"event: done\ndata: {orjson.dumps({'status': 'success', 'posts': posts}).decode()}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
-@app.get("/generations", response_model=List[models.Generation])
-def get_user_generations(current_user: models.User = Depends(get_current_user)):
-    return current_user.generations
+# Documents the schema only; returning a Response directly skips response_model validation.
+@app.get("/generations", response_model=List[models.GenerationPublic])
+async def get_user_generations(
+    limit: int = Query(100, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: models.User = Depends(get_current_user),
+    session: AsyncSession = Depends(get_session),
+):
+    rows = (await session.exec(
+        select(models.Generation)
+        .where(models.Generation.owner_id == current_user.id)
+        .order_by(models.Generation.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )).all()
+    # generated_posts is already JSON text, so embed it verbatim rather than re-serializing.
+    body = orjson.dumps([
+        {**row.model_dump(), "generated_posts": orjson.Fragment(row.generated_posts)}
+        for row in rows
+    ])
+    return Response(content=body, media_type="application/json")
 
 @app.post("/create-checkout-session")
-def create_checkout_session(current_user: models.User = Depends(get_current_user), session: Session = Depends(get_session)):
+async def create_checkout_session(current_user: models.User = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
     try:
         if not current_user.stripe_customer_id:
-            customer = stripe.Customer.create(email=current_user.email)
-            current_user.stripe_customer_id = customer.id
-            session.add(current_user)
-            session.commit()
-            session.refresh(current_user)
-        checkout_session = stripe.checkout.Session.create(
+            customer = await stripe.Customer.create_async(email=current_user.email)
+            # Update a session-bound copy; current_user may be shared through the token cache.
+            user = await session.get(models.User, current_user.id)
+            user.stripe_customer_id = customer.id
+            session.add(user)
+            await session.commit()
+            await session.refresh(user)
+            _evict_cached_user(user.id)
+            current_user = user
+        checkout_session = await stripe.checkout.Session.create_async(
             customer=current_user.stripe_customer_id,
             line_items=[{"price": STRIPE_PRICE_ID, "quantity": 1}],
             mode="subscription",
@@ -179,20 +411,25 @@ def create_checkout_session(current_user: models.User = Depends(get_current_user
 @app.post("/stripe-webhook")
 async def stripe_webhook(request: Request):
     payload = await request.body()
-    event = None
+    sig_header = request.headers.get("stripe-signature")
     try:
-        event = json.loads(payload)
-    except json.JSONDecodeError:
+        # Verifies the HMAC-SHA256 signature and parses the payload in one step.
+        event = stripe.Webhook.construct_event(payload, sig_header, STRIPE_WEBHOOK_SECRET)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid payload")
-    if event["type"] == 'checkout.session.completed':
-        session_data = event["data"]["object"]
-        user_id = session_data.get("metadata", {}).get("user_id")
-        if user_id:
-            with Session(engine) as db_session:
-                user = db_session.get(models.User, int(user_id))
-                if user:
-                    user.subscription_status = "pro"
-                    db_session.add(user)
-                    db_session.commit()
-                    print(f"User {user_id} upgraded to Pro.")
+    except stripe.SignatureVerificationError:
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    if event["type"] != 'checkout.session.completed':
+        return {"status": "ignored"}
+    session_data = event["data"]["object"]
+    user_id = (session_data.get("metadata") or {}).get("user_id")
+    if user_id:
+        async with AsyncSessionLocal() as db_session:
+            user = await db_session.get(models.User, int(user_id))
+            if user:
+                user.subscription_status = "pro"
+                db_session.add(user)
+                await db_session.commit()
+                _evict_cached_user(int(user_id))
+                print(f"User {user_id} upgraded to Pro.")
     return {"status": "success"}
\ No newline at end of file
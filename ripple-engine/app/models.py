@@ -1,20 +1,42 @@
-from sqlmodel import Field, SQLModel, Relationship, JSON, Column
-from datetime import datetime
+from pydantic import EmailStr, field_validator
+from sqlalchemy import DateTime, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import configure_mappers
+from sqlmodel import Field, SQLModel, Relationship, JSON, Column, Text
+from datetime import datetime, timezone
 from typing import Optional, List
 
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def normalize_email(email: str) -> str:
+    """Emails are stored and compared lower-cased so case variants can't register twice."""
+    return email.strip().lower()
+
 # ===================================================================
 # 1. GENERATION MODEL
 #    This table stores the history of generated posts.
 # ===================================================================
 class Generation(SQLModel, table=True):
+    # Lets platform filters like `selected_platforms ? 'Twitter'` use a GIN index on Postgres.
+    # Other dialects ignore postgresql_using and build a plain index.
+    __table_args__ = (
+        Index("ix_generation_selected_platforms", "selected_platforms", postgresql_using="gin"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     original_text: str
-    generated_posts: dict = Field(sa_column=Column(JSON))
-    selected_platforms: List[str] = Field(sa_column=Column(JSON))
-    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    # Stored pre-serialized ({"posts": [...]}) so /generations can splice it into the
+    # response without a decode/re-encode round trip.
+    generated_posts: str = Field(sa_column=Column(Text))
+    # JSONB on Postgres (binary storage, GIN-indexable); plain JSON on SQLite.
+    selected_platforms: List[str] = Field(sa_column=Column(JSON().with_variant(JSONB(), "postgresql")))
+    # server_default covers tables built by migrations; the Python default is still needed for
+    # tables created before it existed (SQLite can't add a default to an existing column).
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False))
 
     # Foreign key to link to the User table
-    owner_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    owner_id: Optional[int] = Field(default=None, foreign_key="user.id", index=True)
     # Relationship to access the User object from a Generation instance
     owner: "User" = Relationship(back_populates="generations")
 
@@ -26,7 +48,7 @@ class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     email: str = Field(index=True, unique=True)
     hashed_password: str
-    created_at: datetime = Field(default_factory=datetime.utcnow, nullable=False)
+    created_at: datetime = Field(sa_column=Column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False))
 
     # --- NEW MONETIZATION FIELDS ---
     stripe_customer_id: Optional[str] = Field(default=None, index=True)
@@ -37,20 +59,43 @@ class User(SQLModel, table=True):
     # Relationship to access all generations for a user (e.g., my_user.generations)
     generations: List["Generation"] = Relationship(back_populates="owner")
 
+# Case-insensitive uniqueness and lookups, including rows stored before emails were normalized.
+# Declared after the class because the expression needs the mapped column.
+Index("ix_user_email_lower", func.lower(User.email), unique=True)
+
 # ===================================================================
 # 3. API-SPECIFIC MODELS (Pydantic models)
 #    These define the shape of data for API requests and responses.
 # ===================================================================
 
 class UserCreate(SQLModel):
-    email: str
+    email: EmailStr
     password: str
 
+    @field_validator("email")
+    @classmethod
+    def lowercase_email(cls, v: str) -> str:
+        # EmailStr validates the address and lower-cases only the domain.
+        return normalize_email(v)
+
 class UserPublic(SQLModel):
     id: int
     email: str
     created_at: datetime
 
+class GenerationPublic(SQLModel):
+    # Response shape of /generations: generated_posts is returned as the decoded object,
+    # not the JSON text it is stored as.
+    id: int
+    original_text: str
+    generated_posts: dict
+    selected_platforms: List[str]
+    created_at: datetime
+    owner_id: Optional[int]
+
 class Article(SQLModel):
     text: str
-    platforms: List[str]
\ No newline at end of file
+    platforms: List[str]
+
+# Resolve the User <-> Generation relationships now, at import, instead of lazily on the first query.
+configure_mappers()
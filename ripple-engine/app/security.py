@@ -1,8 +1,9 @@
 from passlib.context import CryptContext
+import anyio
 import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional
-from jose import JWTError, jwt
+import jwt
 
 # --- JWT Configuration ---
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -24,13 +25,52 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Create a CryptContext object, specifying the hashing scheme
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Create a CryptContext object, specifying the hashing scheme.
+# New hashes use Argon2id at 64 MiB / 3 passes / 1 lane, which bounds the CPU and RAM
+# spent per hash. bcrypt stays as a legacy verifier; those hashes are upgraded on login.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=65536,
+    argon2__time_cost=3,
+    argon2__parallelism=1,
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a plain password against a hashed one."""
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """Verifies a password and returns a replacement hash if the stored one is outdated."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def hash_password(password: str) -> str:
     """Hashes a plain password."""
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+# Hashing is CPU-bound (~100 ms and 64 MiB per Argon2id call), so async endpoints run it
+# in worker threads. The limiter bounds how many hashes run at once, and with it the RAM.
+_HASH_CONCURRENCY = (os.cpu_count() or 1) * 2
+_hash_limiter: Optional[anyio.CapacityLimiter] = None
+
+def _get_hash_limiter() -> anyio.CapacityLimiter:
+    global _hash_limiter
+    if _hash_limiter is None:
+        _hash_limiter = anyio.CapacityLimiter(_HASH_CONCURRENCY)
+    return _hash_limiter
+
+async def hash_password_async(password: str) -> str:
+    """Hashes a plain password without blocking the event loop."""
+    return await anyio.to_thread.run_sync(hash_password, password, limiter=_get_hash_limiter())
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+    """Async variant of verify_and_update_password, run in the bounded thread pool."""
+    return await anyio.to_thread.run_sync(
+        verify_and_update_password, plain_password, hashed_password, limiter=_get_hash_limiter()
+    )
+
+async def warm_up() -> None:
+    """Loads the argon2 backend and PyJWT's HMAC signer before the first request needs them."""
+    await hash_password_async("warmup")
+    create_access_token({"sub": "warmup"})
@@ -0,0 +1,128 @@
+import json
+import os
+import struct
+import threading
+from typing import List, Optional
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_INDEX_PATH = "semantic_cache.faiss"
+
+# On-disk layout: an 8-byte little-endian length, the serialized faiss index, then the
+# payloads as JSON. One file keeps the index and its payloads from being mixed up when
+# several workers save at shutdown.
+_HEADER = struct.Struct("<Q")
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache for near-duplicate articles.
+    Each indexed article embedding maps to a dict of {platforms_tuple: posts}.
+    """
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH, threshold: float = DEFAULT_THRESHOLD):
+        self.index_path = index_path
+        self.threshold = threshold
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._payloads: List[dict] = []
+        try:
+            import faiss
+            import numpy as np
+            from sentence_transformers import SentenceTransformer
+            self._faiss = faiss
+            self._np = np
+            self._model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+            self._index = faiss.IndexFlatIP(EMBEDDING_DIM)
+            self.enabled = True
+        except Exception as e:
+            print(f"Semantic cache disabled: {e}")
+
+    @staticmethod
+    def _platforms_key(platforms: List[str]) -> tuple:
+        return tuple(sorted(platforms))
+
+    def embed(self, text: str):
+        """Returns an L2-normalised (1, 384) float32 embedding, or None when disabled."""
+        if not self.enabled:
+            return None
+        return self._model.encode([text], normalize_embeddings=True).astype("float32")
+
+    def _nearest(self, embedding) -> Optional[int]:
+        """Index of the closest stored article above the threshold. Caller holds the lock."""
+        if self._index.ntotal == 0:
+            return None
+        D, I = self._index.search(embedding, 1)
+        i = int(I[0, 0])
+        if D[0, 0] < self.threshold or not 0 <= i < len(self._payloads):
+            return None
+        return i
+
+    def get(self, embedding, platforms: List[str]) -> Optional[list]:
+        if embedding is None:
+            return None
+        with self._lock:
+            i = self._nearest(embedding)
+            return None if i is None else self._payloads[i].get(self._platforms_key(platforms))
+
+    def set(self, embedding, platforms: List[str], posts: list) -> None:
+        if embedding is None:
+            return
+        key = self._platforms_key(platforms)
+        with self._lock:
+            # Reuse the neighbour's entry so one article doesn't end up indexed once per platform set.
+            i = self._nearest(embedding)
+            if i is not None:
+                self._payloads[i][key] = posts
+                return
+            self._index.add(embedding)
+            self._payloads.append({key: posts})
+
+    def load(self) -> None:
+        """Reloads a previously persisted index and its payloads, if present."""
+        if not self.enabled or not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            (index_size,) = _HEADER.unpack_from(data)
+            index_bytes = self._np.frombuffer(data, dtype=self._np.uint8, count=index_size, offset=_HEADER.size)
+            index = self._faiss.deserialize_index(index_bytes)
+            entries = json.loads(data[_HEADER.size + index_size:])
+            if index.ntotal != len(entries):
+                print(f"Ignoring semantic cache: {index.ntotal} vectors but {len(entries)} payloads.")
+                return
+            with self._lock:
+                self._index = index
+                self._payloads = [{tuple(p): posts for p, posts in entry} for entry in entries]
+            print(f"INFO:     Loaded {index.ntotal} semantic cache entries.")
+        except Exception as e:
+            print(f"Failed to load semantic cache: {e}")
+
+    def save(self) -> None:
+        """
+        Persists the index and payloads as one file, written to a per-process temp file and
+        renamed into place. With several workers the last one to save wins, intact.
+        """
+        if not self.enabled:
+            return
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with self._lock:
+                index_bytes = self._faiss.serialize_index(self._index).tobytes()
+                entries = [[[list(p), posts] for p, posts in payload.items()] for payload in self._payloads]
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(len(index_bytes)))
+                f.write(index_bytes)
+                f.write(json.dumps(entries).encode())
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            print(f"Failed to save semantic cache: {e}")
+
+
+def build_semantic_cache() -> SemanticCache:
+    return SemanticCache(
+        index_path=os.getenv("SEMANTIC_CACHE_PATH", DEFAULT_INDEX_PATH),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+    )
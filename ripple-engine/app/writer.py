@@ -0,0 +1,79 @@
+import asyncio
+import os
+from typing import List
+
+from sqlalchemy import insert
+
+from . import models
+from .database import AsyncSessionLocal
+
+WRITE_BATCH_MAX_SIZE = int(os.getenv("WRITE_BATCH_MAX_SIZE", 32))
+WRITE_BATCH_WAIT_MS = int(os.getenv("WRITE_BATCH_WAIT_MS", 10))
+
+
+class GenerationWriter:
+    """
+    Coalesces Generation inserts from concurrent requests into a single
+    multi-row INSERT and one commit. Results from one micro-batched LLM call
+    resolve together, so their rows naturally land in the same write batch.
+    """
+
+    def __init__(self, max_size: int = WRITE_BATCH_MAX_SIZE, wait_ms: int = WRITE_BATCH_WAIT_MS):
+        self.max_size = max_size
+        self.wait = wait_ms / 1000
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def submit(self, row: dict) -> None:
+        """Queues one Generation row and returns once it has been committed."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, fut))
+        await fut
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.wait
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._insert([row for row, _ in batch])
+                error = None
+            except Exception as e:
+                print(f"An error occurred while saving generations: {e}")
+                error = e
+            for _, fut in batch:
+                if fut.done():
+                    continue
+                if error is None:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(error)
+
+    @staticmethod
+    async def _insert(rows: List[dict]) -> None:
+        async with AsyncSessionLocal() as session:
+            await session.execute(insert(models.Generation), rows)
+            await session.commit()
+
+
+writer = GenerationWriter()
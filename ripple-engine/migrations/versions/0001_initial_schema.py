@@ -0,0 +1,55 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-14 04:07:06.476756
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('email', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('hashed_password', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.Column('stripe_customer_id', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('subscription_status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('usage_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_user_email', 'user', ['email'], unique=True)
+    op.create_index('ix_user_stripe_customer_id', 'user', ['stripe_customer_id'], unique=False)
+    op.create_index('ix_user_email_lower', 'user', [sa.text('lower(email)')], unique=True)
+
+    op.create_table('generation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('original_text', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('generated_posts', sa.Text(), nullable=True),
+    sa.Column('selected_platforms', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.Column('owner_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['owner_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_generation_owner_id', 'generation', ['owner_id'], unique=False)
+    op.create_index('ix_generation_selected_platforms', 'generation', ['selected_platforms'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('generation')
+    op.drop_table('user')